@@ -3,51 +3,230 @@
 
 import re
 import os
+import sys
 import json
 import time
+import hashlib
+import mmap
+import socket
+import logging
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import threading
-from typing import List
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from typing import List, Optional
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+try:
+    import tiktoken  # 可選：用於精確估算OpenAI模型的token數
+except ImportError:
+    tiktoken = None
+
+try:
+    import orjson  # 可選：以更快的C實作編碼請求、解析響應
+except ImportError:
+    orjson = None
+
+# 設定環境變數 SRT_LOG=DEBUG 以輸出每次API請求的響應狀態及批次翻譯的詳細過程
+log = logging.getLogger(__name__)
+
+# 同時進行的批次翻譯請求數（預設值）
+MAX_CONCURRENT_BATCHES = 4
+
+# 同時翻譯的檔案數；所有檔案共用並行請求數上限
+MAX_CONCURRENT_FILES = 2
+
+# 連線池大小，同時也是可設定的並行請求數上限
+HTTP_POOL_SIZE = 32
+
+# API請求逾時（連線, 讀取），單位秒；長批次的生成時間可能超過30秒
+REQUEST_TIMEOUT = (5, 60)
+
+# 翻譯過程中保存索引檔與快取的間隔（秒），程式中斷後可從此處續譯
+CHECKPOINT_INTERVAL = 30
+
+# 主線程處理界面更新隊列的間隔（毫秒）；連續沒有更新時放慢到UI_IDLE_POLL_MS
+UI_POLL_MS = 100
+UI_IDLE_POLL_MS = 250
+
+# 收到429後請求間隔的調整範圍（秒）；成功時間隔按RATE_RECOVERY逐步縮短
+RATE_MIN_INTERVAL = 0.1
+RATE_MAX_INTERVAL = 10.0
+RATE_RECOVERY = 0.9
+
+# Retry-After最多等待的秒數，避免異常的標頭讓翻譯停住太久
+RATE_MAX_RETRY_AFTER = 60.0
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After標頭（秒數或HTTP日期），返回需等待的秒數"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), RATE_MAX_RETRY_AFTER)
+
+class RateLimiter:
+    """請求間隔控制：可設定每分鐘請求數上限；收到429時加倍間隔並遵守Retry-After，請求成功後逐步恢復"""
+    
+    def __init__(self, rpm: int = 0):
+        self.min_interval = 60.0 / rpm if rpm > 0 else 0.0  # 每分鐘請求數設定對應的最小間隔，0表示不限
+        self.interval = self.min_interval
+        self._next = 0.0  # 下一個請求可送出的時間
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            if not self.interval and self._next <= now:
+                return
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+    
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.interval = min(RATE_MAX_INTERVAL, max(RATE_MIN_INTERVAL, self.min_interval, self.interval * 2))
+            if retry_after:
+                # 所有線程的下一個請求都延後到伺服器要求的時間之後
+                self._next = max(self._next, time.monotonic() + retry_after)
+        log.warning("API限速，請求間隔調整為 %.2f 秒", self.interval)
+    
+    def on_success(self):
+        if self.interval <= self.min_interval:
+            return
+        with self._lock:
+            self.interval *= RATE_RECOVERY
+            if self.interval < max(RATE_MIN_INTERVAL, self.min_interval):
+                self.interval = self.min_interval
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """開啟TCP keep-alive，避免閒置的池內連線在批次或檔案之間被中間設備無聲斷開"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+def _create_shared_session() -> requests.Session:
+    """建立所有翻譯器共用的Session，重用連線以省去重複的TLS握手"""
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        read=0,  # 讀取逾時不重送：伺服器可能仍在生成，重送會再計費一次並長時間佔用請求名額
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,  # POST也需要重試
+        raise_on_status=False
+    )
+    # pool_block：連線全部使用中時等待歸還，而不是另開用完即丟的新連線
+    adapter = _KeepAliveAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE,
+                                max_retries=retry, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+_SHARED_SESSION = _create_shared_session()
+
+def warm_up_connections(api_url: str, connections: int = 1):
+    """在背景向API主機發送HEAD請求，預先建立連線池中的連線（失敗時忽略）"""
+    parsed = urlparse(api_url)
+    if not parsed.scheme or not parsed.netloc:
+        return
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    
+    def head():
+        try:
+            _SHARED_SESSION.head(origin, timeout=5)
+        except Exception:
+            pass
+    
+    for _ in range(max(1, min(connections, HTTP_POOL_SIZE))):
+        threading.Thread(target=head, daemon=True).start()
+
+# 翻譯快取檔案及最大條目數
+TRANSLATION_CACHE_FILE = "srt_translator_cache.json"
+TRANSLATION_CACHE_SIZE = 20000
 
 class SRTEntry:
+    __slots__ = ("index", "start_time", "end_time", "text", "translated_text", "word_count", "header")
+    
     def __init__(self, index: int, start_time: str, end_time: str, text: str):
         self.index = index
-        self.start_time = start_time
-        self.end_time = end_time
+        # 時間軸常首尾相接（前一條的結束即下一條的開始），同一檔案重新載入時也完全相同，駐留後共用同一字串
+        self.start_time = sys.intern(start_time)
+        self.end_time = sys.intern(end_time)
         self.text = text.strip()
         self.translated_text = ""
+        self.word_count = len(self.text.split())  # 解析時計算一次，分批時直接使用
+        self.header = f"{index}\n{self.start_time} --> {self.end_time}\n"  # 序號與時間軸行，寫出時直接使用
         
     def __str__(self):
-        return f"{self.index}\n{self.start_time} --> {self.end_time}\n{self.text}\n"
+        return f"{self.header}{self.text}\n"
+
+# SRT條目之間的分隔：空行或只有空白的行
+_SRT_BLOCK_SEP_RE = re.compile(r'\n\s*\n')
+
+# 超過此大小的SRT檔案以mmap讀取
+MMAP_THRESHOLD = 1 << 20
 
 class SRTParser:
+    @staticmethod
+    def read_srt_file(file_path: str) -> str:
+        """以位元組讀取SRT檔案，一次解碼（並去除BOM）後統一換行符"""
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    text = str(mm, 'utf-8-sig')
+            else:
+                text = f.read().decode('utf-8-sig')
+        
+        # 一般只有CRLF，單獨的CR（舊Mac格式）很少見，分開處理以免多複製一次整個檔案
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+            if '\r' in text:
+                text = text.replace('\r', '\n')
+        return text
+    
     @staticmethod
     def parse_srt(content: str) -> List[SRTEntry]:
+        """按空行切分條目，每塊依序為序號行、時間軸行與字幕文字；無法解析的塊略過"""
         entries = []
-        blocks = re.split(r'\n\s*\n', content.strip())
-        
-        for block in blocks:
-            if not block.strip():
-                continue
-                
+        append = entries.append
+        for block in _SRT_BLOCK_SEP_RE.split(content.strip()):
             lines = block.strip().split('\n')
             if len(lines) < 3:
                 continue
-                
+            
+            start_time, separator, end_time = lines[1].partition('-->')
+            if not separator:
+                continue
             try:
                 index = int(lines[0])
-                time_line = lines[1]
-                text = '\n'.join(lines[2:])
-                
-                if ' --> ' in time_line:
-                    start_time, end_time = time_line.split(' --> ')
-                    entries.append(SRTEntry(index, start_time.strip(), end_time.strip(), text))
-            except (ValueError, IndexError):
+            except ValueError:
                 continue
-                
+            append(SRTEntry(index, start_time.strip(), end_time.strip(), '\n'.join(lines[2:])))
+        
         return entries
     
     @staticmethod
@@ -84,176 +263,417 @@ class SRTParser:
     
     @staticmethod
     def entries_to_srt(entries: List[SRTEntry], auto_wrap: bool = False) -> str:
-        result = []
+        parts = []
+        extend = parts.extend
         for entry in entries:
-            text = entry.translated_text if entry.translated_text else entry.text
+            text = entry.translated_text or entry.text
             
             # 如果啟用自動分行，對文本進行處理
             if auto_wrap and text:
                 text = SRTParser.auto_wrap_text(text)
             
-            result.append(f"{entry.index}\n{entry.start_time} --> {entry.end_time}\n{text}\n")
-        return '\n'.join(result)
+            extend((entry.header, text, "\n\n"))
+        
+        # 最後一個條目之後只保留一個換行
+        if parts:
+            parts[-1] = "\n"
+        return "".join(parts)
+    
+    @staticmethod
+    def write_entries(fp, entries: List[SRTEntry], auto_wrap: bool = False, leading_separator: bool = False):
+        """將一段條目拼成一個字串後一次寫入檔案，格式與entries_to_srt相同；leading_separator用於接續已寫入的內容"""
+        if not entries:
+            return
+        if leading_separator:
+            fp.write("\n")
+        fp.write(SRTParser.entries_to_srt(entries, auto_wrap))
+
+# 快取與索引檔由單一背景線程依序寫入，不阻塞翻譯線程
+_BACKGROUND_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="srt-writer")
+
+def _load_json_file(path: str):
+    """讀取JSON檔案；安裝了orjson時直接解析位元組"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _dump_json_file(path: str, data):
+    """以UTF-8寫入JSON檔案（不轉義非ASCII字元）；安裝了orjson時直接寫入編碼後的位元組"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+class TranslationCache:
+    """以 (API網址與模型, sha1(正規化原文)) 為鍵的翻譯快取：記憶體內LRU，並可保存到磁碟"""
+    def __init__(self, path: str = TRANSLATION_CACHE_FILE, max_size: int = TRANSLATION_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+    
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        # 忽略首尾空白及空白數量的差異
+        normalized = " ".join(text.split())
+        return f"{namespace}:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()}"
+    
+    def load(self):
+        """從磁碟載入快取（只在第一次調用時讀取）"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                return
+            try:
+                self._data.update(_load_json_file(self.path))
+            except Exception as e:
+                log.warning("載入翻譯快取失敗: %s", e)
+    
+    def get(self, namespace: str, text: str) -> Optional[str]:
+        key = self.make_key(namespace, text)
+        with self._lock:
+            translation = self._data.get(key)
+            if translation is not None:
+                self._data.move_to_end(key)
+            return translation
+    
+    def put(self, namespace: str, text: str, translation: str):
+        if not translation or translation.startswith("[翻譯失敗]"):
+            return
+        key = self.make_key(namespace, text)
+        with self._lock:
+            self._data[key] = translation
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self._dirty = True
+    
+    def save(self):
+        """將快取寫回磁碟（沒有變更時不寫入）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._data)
+            self._dirty = False
+        try:
+            tmp_path = f"{self.path}.tmp"
+            _dump_json_file(tmp_path, snapshot)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.warning("保存翻譯快取失敗: %s", e)
+    
+    def load_in_background(self):
+        _BACKGROUND_WRITER.submit(self.load)
+    
+    def save_in_background(self):
+        _BACKGROUND_WRITER.submit(self.save)
+
+_TRANSLATION_CACHE = TranslationCache()
+
+class TranslationIndex:
+    """.zh.srt旁的索引檔，記錄每個已成功翻譯條目的原文雜湊與譯文，重新載入時可跳過未變更的條目
+    
+    同時記錄產生譯文的API與模型（source）及自動分行設定，用於判斷輸出檔案是否可以原樣沿用。
+    """
+    @staticmethod
+    def index_path(output_path: str) -> str:
+        return f"{output_path}.idx"
+    
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def save(output_path: str, entries: List[SRTEntry], source: Optional[str] = None,
+             auto_wrap: Optional[bool] = None):
+        # 以條目在檔案中的位置為鍵：字幕序號可能重複，插入或刪除條目後也會重新編號
+        index = {}
+        for pos, entry in enumerate(entries):
+            if entry.translated_text and not entry.translated_text.startswith("[翻譯失敗]"):
+                index[str(pos)] = {
+                    'sha1': TranslationIndex.text_hash(entry.text),
+                    'header': entry.header,
+                    'text': entry.translated_text
+                }
+        data = {'source': source, 'auto_wrap': auto_wrap, 'entries': index}
+        _BACKGROUND_WRITER.submit(TranslationIndex._write, TranslationIndex.index_path(output_path), data)
+    
+    @staticmethod
+    def discard(output_path: str):
+        """刪除索引檔（輸出檔案沒有完整寫入時，舊索引不再與其內容對應）"""
+        _BACKGROUND_WRITER.submit(TranslationIndex._remove, TranslationIndex.index_path(output_path))
+    
+    @staticmethod
+    def _remove(index_path: str):
+        try:
+            os.remove(index_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("刪除翻譯索引失敗: %s", e)
+    
+    @staticmethod
+    def _write(index_path: str, data: dict):
+        try:
+            _dump_json_file(index_path, data)
+        except Exception as e:
+            log.warning("保存翻譯索引失敗: %s", e)
+    
+    @staticmethod
+    def apply(output_path: str, entries: List[SRTEntry]):
+        """將原文未變更的既有譯文填回entries，返回 (填回的條目數, 索引資訊)
+        
+        索引資訊為 {'source', 'auto_wrap', 'complete'}，沒有索引檔時為None；
+        complete表示索引與entries逐條對應（位置、序號、時間軸與原文都相同）且全部填回，即現有的輸出檔案與本次內容相同。
+        """
+        index_path = TranslationIndex.index_path(output_path)
+        if not (os.path.exists(output_path) and os.path.exists(index_path)):
+            return 0, None
+        try:
+            data = _load_json_file(index_path)
+            index = data.get('entries', {})
+        except Exception as e:
+            log.warning("載入翻譯索引失敗: %s", e)
+            return 0, None
+        
+        # 同一位置的原文未變更時直接沿用；位置移動過的條目（前面插入或刪除了條目）按原文雜湊查找
+        by_hash = None
+        reused = 0
+        in_place = 0
+        for pos, entry in enumerate(entries):
+            sha1 = TranslationIndex.text_hash(entry.text)
+            record = index.get(str(pos))
+            if record and record.get('sha1') == sha1:
+                # 序號與時間軸也相同時，輸出檔案中的這個條目不需重寫
+                if record.get('header') == entry.header:
+                    in_place += 1
+            else:
+                if by_hash is None:
+                    by_hash = {}
+                    for other in index.values():
+                        by_hash.setdefault(other.get('sha1'), other)
+                record = by_hash.get(sha1)
+            if record:
+                entry.translated_text = record.get('text', "")
+                if entry.translated_text:
+                    reused += 1
+        
+        info = {
+            'source': data.get('source'),
+            'auto_wrap': data.get('auto_wrap'),
+            'complete': in_place == reused == len(index) == len(entries)
+        }
+        return reused, info
+
+# 固定的翻譯指示，與每次請求的原文分開，不需在每個提示詞中重複組裝
+_SYSTEM_PROMPT = """請將使用者提供的英文字幕翻譯成繁體中文。要求：
+1. 保持原文的語氣和情感
+2. 不要翻譯專有名詞（人名、地名、品牌名等）
+3. 保持字幕的簡潔性
+4. 確保翻譯自然流暢
+
+只回覆翻譯結果，不要包含其他說明。"""
 
 class APITranslator:
-    def __init__(self, api_url: str, model: str, api_key: str = ""):
+    def __init__(self, api_url: str, model: str, api_key: str = "",
+                 max_concurrent: int = MAX_CONCURRENT_BATCHES, rpm: int = 0):
         self.api_url = api_url
         self.model = model
         self.api_key = api_key.strip() if api_key else ""
-        self.session = requests.Session()
-        self.current_max_tokens = 1000  # 默認值
+        self.session = _SHARED_SESSION
+        # 所有使用此翻譯器的檔案與批次共用的並行請求數上限
+        self._request_slots = threading.Semaphore(max(1, max_concurrent))
+        self.rate_limiter = RateLimiter(rpm)
+        self.cache = _TRANSLATION_CACHE
+        self.cache.load()
+        self.cache_namespace = APITranslator.namespace_for(self.api_url, self.model)  # 更換API或模型時不沿用舊譯文
+        
+        # 請求模板只建立一次，每次調用時淺拷貝
+        self._base_payload = {"model": self.model, "temperature": 0.3}
+        
+        # 只有当API key存在时才添加认证头
+        self._bearer_headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        self._anthropic_headers = {"anthropic-version": "2023-06-01"}
+        if self.api_key:
+            self._anthropic_headers["x-api-key"] = self.api_key
         
-    def calculate_max_tokens(self, input_word_count: int) -> int:
-        """根據輸入字數計算合適的max_tokens值"""
-        # 基本公式：中文輸出通常比英文輸入短，但API需要額外空間
-        # 估計每個英文詞對應1.2個中文字符，再加上一些緩衝
-        estimated_output = int(input_word_count * 1.5)
+        # API類型在建立時判斷一次，之後每次請求直接調用對應的實作
+        if "openai" in self.api_url.lower() or "api.openai.com" in self.api_url:
+            self._translate_api = self._translate_openai
+        elif "anthropic" in self.api_url.lower() or "claude" in self.model.lower():
+            self._translate_api = self._translate_anthropic
+        else:
+            self._translate_api = self._translate_generic
+        
+        # 檢查API URL是否正確
+        if not self.api_url.endswith(('/v1/chat/completions', '/messages', '/chat/completions')):
+            log.warning("API網址可能不正確: %s\n常見的API端點:\n"
+                        "- OpenAI: https://api.openai.com/v1/chat/completions\n"
+                        "- Claude: https://api.anthropic.com/v1/messages\n"
+                        "- 自定義: 通常以 /v1/chat/completions 結尾", self.api_url)
+    
+    # 每個模型的tokenizer只建立一次；None表示該模型沒有可用的tokenizer
+    _encoders = {}
+    _encoders_lock = threading.Lock()
+    
+    def _get_encoder(self):
+        if tiktoken is None:
+            return None
+        with APITranslator._encoders_lock:
+            if self.model not in APITranslator._encoders:
+                try:
+                    APITranslator._encoders[self.model] = tiktoken.encoding_for_model(self.model)
+                except Exception:
+                    APITranslator._encoders[self.model] = None
+            return APITranslator._encoders[self.model]
+    
+    def estimate_tokens(self, text: str) -> int:
+        """估算文本的token數：有tokenizer時精確計算，否則按字符估算"""
+        encoder = self._get_encoder()
+        if encoder is not None:
+            return len(encoder.encode(text))
+        
+        # 英文約每4個字符一個token，中日韓等非ASCII字符約每字一個token
+        non_ascii = sum(1 for ch in text if ord(ch) > 127)
+        return (len(text) - non_ascii) // 4 + non_ascii + 1
+    
+    def calculate_max_tokens(self, input_tokens: int) -> int:
+        """根據輸入token數計算合適的max_tokens值"""
+        # 中文譯文的token數與英文原文相近，加上40%的緩衝空間
+        calculated_tokens = int(input_tokens * 1.4)
         
         # 設定最小值和最大值
         min_tokens = 200
         max_tokens = 4000
         
-        # 加上30%的緩衝空間
-        calculated_tokens = int(estimated_output * 1.3)
-        
         return max(min_tokens, min(calculated_tokens, max_tokens))
         
-    def translate_text(self, text: str, context: str = "", word_count: int = None) -> str:
-        prompt = f"""請將以下英文字幕翻譯成繁體中文。要求：
-1. 保持原文的語氣和情感
-2. 不要翻譯專有名詞（人名、地名、品牌名等）
-3. 保持字幕的簡潔性
-4. 確保翻譯自然流暢
-
-{f"前面的上下文參考：{context}" if context else ""}
-
-需要翻譯的文本：
-{text}
-
-只回覆翻譯結果，不要包含其他說明："""
-
-        # 動態計算max_tokens
-        if word_count:
-            self.current_max_tokens = self.calculate_max_tokens(word_count)
+    def translate_text(self, text: str, context: str = "") -> str:
+        cached = self.get_cached(text)
+        if cached is not None:
+            return cached
+        
+        translation = self._translate_uncached(text, context)
+        self.put_cached(text, translation.strip())
+        return translation
+    
+    @staticmethod
+    def namespace_for(api_url: str, model: str) -> str:
+        """快取與翻譯索引用於區分來源的命名空間"""
+        return f"{api_url}|{model}"
+    
+    def get_cached(self, text: str) -> Optional[str]:
+        return self.cache.get(self.cache_namespace, text)
+    
+    def put_cached(self, text: str, translation: str):
+        self.cache.put(self.cache_namespace, text, translation)
+    
+    def _translate_uncached(self, text: str, context: str = "") -> str:
+        # 固定指示放在system訊息，user訊息只含變動內容，上下文在前、待翻譯文本在後
+        if context:
+            prompt = f"前面的上下文參考：{context}\n\n需要翻譯的文本：\n{text}"
         else:
-            # 估算當前文本的詞數
-            estimated_words = len(text.split())
-            self.current_max_tokens = self.calculate_max_tokens(estimated_words)
+            prompt = f"需要翻譯的文本：\n{text}"
 
-        # 檢查API URL是否正確
-        if not self.api_url.endswith(('/v1/chat/completions', '/messages', '/chat/completions')):
-            print(f"警告：API網址可能不正確: {self.api_url}")
-            print("常見的API端點:")
-            print("- OpenAI: https://api.openai.com/v1/chat/completions")
-            print("- Claude: https://api.anthropic.com/v1/messages")
-            print("- 自定義: 通常以 /v1/chat/completions 結尾")
+        # 動態計算max_tokens（並行翻譯時各請求各自計算，不共用實例狀態）
+        max_tokens = self.calculate_max_tokens(self.estimate_tokens(text))
 
         try:
-            if "openai" in self.api_url.lower() or "api.openai.com" in self.api_url:
-                return self._translate_openai(prompt)
-            elif "anthropic" in self.api_url.lower() or "claude" in self.model.lower():
-                return self._translate_anthropic(prompt)
-            else:
-                return self._translate_generic(prompt)
+            return self._translate_api(prompt, max_tokens)
         except Exception as e:
             if "<!DOCTYPE html>" in str(e) or "HTML" in str(e):
                 raise Exception(f"API網址返回HTML頁面而非JSON。請檢查API端點是否正確。當前網址: {self.api_url}")
             raise Exception(f"翻譯API調用失敗: {str(e)}")
     
-    def _translate_openai(self, prompt: str) -> str:
-        headers = {
-            "Content-Type": "application/json"
+    def _chat_payload(self, prompt: str, max_tokens: int) -> dict:
+        """OpenAI相容格式：固定指示作為第一則system訊息"""
+        return {
+            **self._base_payload,
+            "messages": [
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens
         }
-        
-        # 只有当API key存在时才添加认证头
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.3,
-            "max_tokens": self.current_max_tokens
+    
+    def _generic_payload(self, prompt: str, max_tokens: int) -> dict:
+        """通用格式：固定指示併入單一user訊息，部分模型的對話範本不接受system角色"""
+        return {
+            **self._base_payload,
+            "messages": [{"role": "user", "content": f"{_SYSTEM_PROMPT}\n\n{prompt}"}],
+            "max_tokens": max_tokens
         }
-        
-        response = self.session.post(self.api_url, headers=headers, json=data, timeout=30)
-        
-        print(f"API響應狀態碼: {response.status_code}")
-        print(f"API響應內容: {response.text[:200]}...")
-        
-        response.raise_for_status()
-        
-        if not response.text.strip():
-            raise Exception("API返回空內容")
-            
-        result = response.json()
-        return result["choices"][0]["message"]["content"].strip()
     
-    def _translate_anthropic(self, prompt: str) -> str:
-        headers = {
-            "Content-Type": "application/json",
-            "anthropic-version": "2023-06-01"
+    def _anthropic_payload(self, prompt: str, max_tokens: int) -> dict:
+        """Anthropic格式：固定指示放在頂層system欄位"""
+        return {
+            **self._base_payload,
+            "system": _SYSTEM_PROMPT,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens
         }
+    
+    def _post_json(self, headers: dict, data: dict, label: str) -> dict:
+        """發送請求並返回解析後的JSON；響應正文只在出錯時才解碼為字串"""
         
-        # 只有当API key存在时才添加认证头
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
+        if orjson is not None:
+            body = {"data": orjson.dumps(data)}
+        else:
+            body = {"json": data}
         
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": self.current_max_tokens,
-            "temperature": 0.3
-        }
+        self.rate_limiter.acquire()
+        with self._request_slots:
+            response = self.session.post(self.api_url, headers=headers, timeout=REQUEST_TIMEOUT, **body)
         
-        response = self.session.post(self.api_url, headers=headers, json=data, timeout=30)
+        log.debug("%s響應狀態碼: %s", label, response.status_code)
         
-        print(f"Anthropic API響應狀態碼: {response.status_code}")
-        print(f"Anthropic API響應內容: {response.text[:500]}...")
+        # Retry已在內部處理429重試，這裡依是否曾被限速調整後續請求的速率
+        retries = getattr(response.raw, "retries", None)
+        if response.status_code == 429:
+            # 重試用盡仍被限速時，讓之後的請求等待伺服器指定的時間
+            self.rate_limiter.on_rate_limited(_parse_retry_after(response.headers.get("Retry-After")))
+        elif retries and any(h.status == 429 for h in retries.history):
+            self.rate_limiter.on_rate_limited()
+        elif response.ok:
+            # 其他錯誤狀態不代表伺服器已恢復，不縮短限速後的等待
+            self.rate_limiter.on_success()
         
-        response.raise_for_status()
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            log.warning("%s響應內容: %s...", label, response.text[:500])
+            raise
         
-        if not response.text.strip():
+        if not response.content.strip():
             raise Exception("API返回空內容")
             
         try:
-            result = response.json()
-        except json.JSONDecodeError as e:
+            if orjson is not None:
+                return orjson.loads(response.content)
+            return response.json()
+        except ValueError:
+            log.warning("%s響應內容: %s...", label, response.text[:500])
             raise Exception(f"API響應不是有效的JSON格式: {response.text[:200]}")
-            
+    
+    def _translate_openai(self, prompt: str, max_tokens: int) -> str:
+        result = self._post_json(self._bearer_headers, self._chat_payload(prompt, max_tokens), "API")
+        return result["choices"][0]["message"]["content"].strip()
+    
+    def _translate_anthropic(self, prompt: str, max_tokens: int) -> str:
+        result = self._post_json(self._anthropic_headers, self._anthropic_payload(prompt, max_tokens), "Anthropic API")
         return result["content"][0]["text"].strip()
     
-    def _translate_generic(self, prompt: str) -> str:
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # 只有当API key存在时才添加认证头
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.3,
-            "max_tokens": self.current_max_tokens
-        }
+    def _translate_generic(self, prompt: str, max_tokens: int) -> str:
+        result = self._post_json(self._bearer_headers, self._generic_payload(prompt, max_tokens), "Generic API")
         
-        response = self.session.post(self.api_url, headers=headers, json=data, timeout=30)
-        
-        print(f"Generic API響應狀態碼: {response.status_code}")
-        print(f"Generic API響應內容: {response.text[:500]}...")
-        
-        response.raise_for_status()
-        
-        if not response.text.strip():
-            raise Exception("API返回空內容")
-            
-        try:
-            result = response.json()
-        except json.JSONDecodeError as e:
-            raise Exception(f"API響應不是有效的JSON格式: {response.text[:200]}")
-            
         if "choices" in result:
             return result["choices"][0]["message"]["content"].strip()
         elif "content" in result:
@@ -261,107 +681,153 @@ class APITranslator:
         else:
             raise Exception(f"不支援的API響應格式: {list(result.keys())}")
 
+# 批次翻譯回覆中的 [編號] 譯文，譯文延續到下一個編號或結尾
+_RESPONSE_RE = re.compile(r'^\s*\[(\d+)\]\s*(.*?)(?=^\s*\[\d+\]|\Z)', re.M | re.S)
+_LINE_BREAK_RE = re.compile(r'\s*\n\s*')
+
+# 作為上下文帶入的前文譯文條數
+CONTEXT_SIZE = 5
+
+# 上下文每隔多少個批次才更新一次；期間的請求共用相同的前綴，伺服器的前綴（KV）快取可以命中
+CONTEXT_ROTATE_BATCHES = 4
+
+# 批次字數的AIMD自動調整：成功時加AIMD_STEP，失敗時減半
+# 上限與介面上批次字數的最大值一致，避免批次過大導致譯文被max_tokens截斷或請求逾時
+AIMD_MIN_WORDS = 30
+AIMD_MAX_WORDS = 500
+AIMD_STEP = 10
+
 class BatchTranslator:
     def __init__(self, translator: APITranslator):
         self.translator = translator
-        
-    def count_words(self, text: str) -> int:
-        return len(text.split())
+        self._recent = deque(maxlen=CONTEXT_SIZE)  # 最近完成的前文譯文
+        self._context = ""  # _recent拼接後的上下文字串
+        self._context_stale = False  # _recent在上次拼接後是否有新譯文
+        self._context_uses = 0  # 目前的上下文字串已用於多少個批次
+        self._aimd_words = 100
+        self._aimd_min = AIMD_MIN_WORDS
+        self._aimd_max = AIMD_MAX_WORDS
+        self._aimd_seed = None  # 目前AIMD所依據的max_words設定
+        self._aimd_lock = threading.Lock()
+    
+    def reset(self):
+        """清除上一個檔案的上下文，以便翻譯下一個檔案；AIMD調整後的批次字數保留沿用"""
+        self._recent.clear()
+        self._context = ""
+        self._context_stale = False
+        self._context_uses = 0
     
-    def create_batches(self, entries: List[SRTEntry], max_words: int = 100) -> List[List[SRTEntry]]:
-        batches = []
-        current_batch = []
-        current_word_count = 0
+    @staticmethod
+    def word_prefix_sums(entries: List[SRTEntry]) -> array:
+        """條目字數的前綴和，第i項為前i個條目的總字數"""
+        prefix = array('Q', [0])
+        prefix.extend(accumulate(entry.word_count for entry in entries))
+        return prefix
+    
+    def next_batch(self, word_prefix: array, start: int, max_words: int) -> int:
+        """從start開始取一個不超過max_words字的批次（至少一個條目），返回批次結束位置
         
-        for entry in entries:
-            entry_words = self.count_words(entry.text)
-            
-            if current_word_count + entry_words > max_words and current_batch:
-                batches.append(current_batch)
-                current_batch = [entry]
-                current_word_count = entry_words
+        word_prefix為word_prefix_sums的結果，以二分搜尋找出批次邊界，不必逐個累加字數。
+        """
+        end = bisect_right(word_prefix, word_prefix[start] + max_words, start + 1) - 1
+        return max(end, start + 1)
+    
+    def record_batch_result(self, success: bool):
+        """AIMD：批次成功時緩慢增大批次字數，超時或解析不匹配時減半"""
+        with self._aimd_lock:
+            if success:
+                self._aimd_words = min(self._aimd_max, self._aimd_words + AIMD_STEP)
             else:
-                current_batch.append(entry)
-                current_word_count += entry_words
-                
-        if current_batch:
-            batches.append(current_batch)
-            
-        return batches
+                self._aimd_words = max(self._aimd_min, self._aimd_words // 2)
     
-    def get_context(self, all_entries: List[SRTEntry], current_start_idx: int) -> str:
-        context_entries = []
-        context_count = 0
-        
-        for i in range(max(0, current_start_idx - 10), current_start_idx):
-            if all_entries[i].translated_text and context_count < 5:
-                context_entries.append(all_entries[i].translated_text)
-                context_count += 1
-                
-        return " ".join(context_entries[-5:]) if context_entries else ""
+    def get_context(self) -> str:
+        # 上下文只在有新譯文加入、且目前的上下文已用滿CONTEXT_ROTATE_BATCHES個批次（或尚為空）時才重新拼接
+        if self._context_stale and (not self._context or self._context_uses >= CONTEXT_ROTATE_BATCHES):
+            self._context = " ".join(self._recent)
+            self._context_stale = False
+            self._context_uses = 0
+        self._context_uses += 1
+        return self._context
     
-    def translate_batch(self, batch: List[SRTEntry], context: str = "") -> List[str]:
-        batch_text = "\n\n".join([f"[{entry.index}] {entry.text}" for entry in batch])
-        
-        # 計算批次總字數
-        total_words = sum(self.count_words(entry.text) for entry in batch)
+    def remember(self, entries: List[SRTEntry]):
+        """按原順序記錄已完成條目的譯文，供後續批次作為上下文"""
+        for entry in entries:
+            if entry.translated_text and not entry.translated_text.startswith("[翻譯失敗]"):
+                self._recent.append(entry.translated_text)
+                self._context_stale = True
+    
+    def translate_batch(self, batch: List[SRTEntry], context: str = "", use_cache: bool = True) -> List[str]:
+        # 先查快取，只把未命中的條目送到API；use_cache=False時全部重新翻譯，譯文仍寫回快取
+        # 以條目在batch中的位置為鍵，字幕序號可能重複
+        cached = {}
+        if use_cache:
+            for pos, entry in enumerate(batch):
+                translation = self.translator.get_cached(entry.text)
+                if translation:
+                    cached[pos] = translation
+        
+        uncached = [pos for pos in range(len(batch)) if pos not in cached]
+        if uncached:
+            translations = self._translate_batch_uncached([batch[pos] for pos in uncached], context)
+            for pos, translation in zip(uncached, translations):
+                cached[pos] = translation
+                self.translator.put_cached(batch[pos].text, translation)
+        
+        return [cached[pos] for pos in range(len(batch))]
+    
+    def _translate_batch_uncached(self, batch: List[SRTEntry], context: str = "") -> List[str]:
+        # 提示詞中的編號為條目在批次中的位置（從1開始），不使用可能重複的字幕序號
+        parts = []
+        append = parts.append
+        for pos, entry in enumerate(batch, 1):
+            append("[")
+            append(str(pos))
+            append("] ")
+            append(entry.text)
+            append("\n\n")
+        parts.pop()  # 最後一個條目後不需要分隔
+        batch_text = "".join(parts)
         
         try:
-            translated = self.translator.translate_text(batch_text, context, word_count=total_words)
+            # 整批回覆不寫入快取（可能缺漏條目），由translate_batch逐條寫入
+            translated = self.translator._translate_uncached(batch_text, context)
             
-            # 更強健的翻譯結果解析
-            translated_lines = []
-            lines = translated.split('\n')
+            # 一次性解析所有 [編號] 譯文，按批次內的位置對應條目
+            found = {}
+            for number, text in _RESPONSE_RE.findall(translated):
+                text = _LINE_BREAK_RE.sub(" ", text.strip())
+                if text:
+                    found.setdefault(int(number) - 1, text)
             
-            current_translation = ""
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # 如果是帶索引的行
-                if line.startswith('[') and ']' in line:
-                    # 保存前一個翻譯
-                    if current_translation:
-                        translated_lines.append(current_translation.strip())
-                    # 開始新翻譯
-                    current_translation = line.split(']', 1)[1].strip()
+            if not found:
+                # 模型沒有保留編號時，單個條目直接使用整個回覆，多個條目按非空行對應
+                if len(batch) == 1:
+                    found = {0: _LINE_BREAK_RE.sub(" ", translated.strip())}
                 else:
-                    # 繼續當前翻譯
-                    if current_translation:
-                        current_translation += " " + line
-                    else:
-                        current_translation = line
-            
-            # 添加最後一個翻譯
-            if current_translation:
-                translated_lines.append(current_translation.strip())
+                    lines = [line.strip() for line in translated.split('\n') if line.strip()]
+                    if len(lines) == len(batch):
+                        found = dict(enumerate(lines))
             
-            # 如果解析結果數量不匹配，嘗試按行分割
-            if len(translated_lines) != len(batch):
-                print(f"警告：翻譯結果數量不匹配 (期望{len(batch)}, 得到{len(translated_lines)})")
-                print(f"原始翻譯內容: {translated}")
-                
-                # 備用解析：直接按非空行分割
-                alt_lines = [line.strip() for line in translated.split('\n') if line.strip()]
-                # 過濾掉可能的索引行
-                alt_lines = [line.split(']', 1)[1].strip() if line.startswith('[') and ']' in line else line for line in alt_lines]
+            missing = [pos for pos in range(len(batch)) if not found.get(pos)]
+            self.record_batch_result(not missing)
+            if missing:
+                log.warning("翻譯結果數量不匹配 (期望%d, 缺少%d)", len(batch), len(missing))
+                log.debug("原始翻譯內容: %s", translated)
                 
-                if len(alt_lines) == len(batch):
-                    translated_lines = alt_lines
-                else:
-                    print(f"備用解析也失敗，將對每個條目單獨翻譯")
+                if len(missing) > len(batch) * 0.2:
+                    log.warning("缺少過多，將對每個條目單獨翻譯")
                     return self.translate_individually(batch, context)
-            
-            # 確保數量匹配
-            while len(translated_lines) < len(batch):
-                translated_lines.append(f"[翻譯失敗] {batch[len(translated_lines)].text}")
                 
-            return translated_lines[:len(batch)]
+                # 只單獨翻譯缺少的條目
+                retried = self.translate_individually([batch[pos] for pos in missing], context)
+                for pos, translation in zip(missing, retried):
+                    found[pos] = translation
+            
+            return [found[pos] for pos in range(len(batch))]
             
         except Exception as e:
-            print(f"批次翻譯失敗: {e}")
-            print(f"將對此批次進行單獨翻譯")
+            self.record_batch_result(False)
+            log.warning("批次翻譯失敗，將對此批次進行單獨翻譯: %s", e)
             return self.translate_individually(batch, context)
     
     def translate_individually(self, batch: List[SRTEntry], context: str = "") -> List[str]:
@@ -369,16 +835,123 @@ class BatchTranslator:
         results = []
         for entry in batch:
             try:
-                translated = self.translator.translate_text(entry.text, context)
+                # 不查快取：送到這裡的條目都已查過快取或要求重新翻譯，譯文由translate_batch寫入快取
+                translated = self.translator._translate_uncached(entry.text, context)
                 results.append(translated.strip())
-                print(f"單獨翻譯完成: [{entry.index}] {entry.text[:30]}...")
+                log.debug("單獨翻譯完成: [%d] %.30s...", entry.index, entry.text)
             except Exception as e:
-                print(f"單獨翻譯失敗 [{entry.index}]: {e}")
+                log.warning("單獨翻譯失敗 [%d]: %s", entry.index, e)
                 results.append(f"[翻譯失敗] {entry.text}")
         return results
+    
+    def translate_all(self, entries: List[SRTEntry], max_words: int = 100,
+                      max_concurrent: int = MAX_CONCURRENT_BATCHES,
+                      progress_callback=None, ordered_callback=None,
+                      executor: Optional[ThreadPoolExecutor] = None,
+                      use_cache: bool = True) -> List[str]:
+        """並行翻譯所有條目，返回與entries順序一致的翻譯結果
+        
+        以滑動窗口送出批次：任一批次完成後立即送出下一個，同時進行的請求不超過max_concurrent。
+        原文相同的條目只翻譯第一次出現的一個，譯文分配給所有重複條目。
+        上下文取自送出時已按順序完成的最近譯文，以換取並行度。
+        批次在送出時才切分，字數從max_words開始按AIMD自動調整（max_words不變時沿用上次的調整結果）。
+        progress_callback(已完成批次數, 預估總批次數, 已完成條目數) 在每個批次完成後調用。
+        ordered_callback(條目列表) 按原順序調用，每次傳入前面條目都已完成的一段連續條目。
+        executor為多個檔案共用的請求線程池；未提供時使用本次專用的線程池。
+        use_cache=False時不使用快取中的譯文（重新翻譯整個檔案時）。
+        """
+        with self._aimd_lock:
+            # 同一設定下連續翻譯多個檔案時，沿用前一個檔案調整後的批次字數
+            if max_words != self._aimd_seed:
+                self._aimd_seed = max_words
+                self._aimd_words = max_words
+                self._aimd_min = min(AIMD_MIN_WORDS, max_words)
+                self._aimd_max = max(AIMD_MAX_WORDS, max_words)
+        
+        # 按正規化後的原文分組，只翻譯每組的第一個條目
+        groups = {}  # 正規化原文 -> entries中的位置列表
+        unique = []  # 每組第一個條目
+        unique_positions = []  # 與unique對應的位置列表
+        for pos, entry in enumerate(entries):
+            key = " ".join(entry.text.split())
+            positions = groups.get(key)
+            if positions is None:
+                positions = groups[key] = []
+                unique.append(entry)
+                unique_positions.append(positions)
+            positions.append(pos)
+        
+        unique_prefix = self.word_prefix_sums(unique)
+        results = [""] * len(entries)
+        entry_done = [False] * len(entries)
+        batches = []  # [(在unique中的起始位置, 條目列表)]，按送出順序
+        
+        completed_batches = 0
+        completed_unique = 0
+        completed_entries = 0
+        next_start = 0  # 下一個批次在unique中的起始位置
+        next_ready = 0  # 尚未交給ordered_callback的第一個條目位置
+        pending = {}  # future -> batch_idx
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent))
+        try:
+            while next_start < len(unique) or pending:
+                # 補滿並行窗口
+                while next_start < len(unique) and len(pending) < max(1, max_concurrent):
+                    end = self.next_batch(unique_prefix, next_start, self._aimd_words)
+                    batch = unique[next_start:end]
+                    future = executor.submit(self.translate_batch, batch, self.get_context(), use_cache)
+                    pending[future] = len(batches)
+                    batches.append((next_start, batch))
+                    next_start = end
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_idx = pending.pop(future)
+                    batch_start, batch = batches[batch_idx]
+                    try:
+                        translations = future.result()
+                    except Exception as e:
+                        log.warning("批次 %d 翻譯失敗: %s", batch_idx + 1, e)
+                        translations = [f"[翻譯失敗] {entry.text}" for entry in batch]
+                    
+                    for offset, translation in enumerate(translations):
+                        for pos in unique_positions[batch_start + offset]:
+                            entries[pos].translated_text = translation
+                            results[pos] = translation
+                            entry_done[pos] = True
+                            completed_entries += 1
+                    
+                    completed_batches += 1
+                    completed_unique += len(batch)
+                    if progress_callback:
+                        # 剩餘條目按目前已完成批次的平均大小估算
+                        remaining = len(unique) - completed_unique
+                        estimated_total = completed_batches + -(-remaining * completed_batches // completed_unique)
+                        progress_callback(completed_batches, estimated_total, completed_entries)
+                
+                ready_start = next_ready
+                while next_ready < len(entries) and entry_done[next_ready]:
+                    next_ready += 1
+                if next_ready > ready_start:
+                    ready_entries = entries[ready_start:next_ready]
+                    self.remember(ready_entries)
+                    if ordered_callback:
+                        ordered_callback(ready_entries)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        
+        return results
 
 class SRTTranslatorGUI:
     def __init__(self):
+        log_level = os.environ.get("SRT_LOG", "WARNING").upper()
+        if not isinstance(logging.getLevelName(log_level), int):
+            log_level = "WARNING"  # 無效的等級名稱不應讓程式無法啟動
+        logging.basicConfig(level=log_level)
         self.root = TkinterDnD.Tk()
         self.root.title("SRT字幕翻譯工具 - 批次處理")
         self.root.geometry("900x700")
@@ -388,9 +961,21 @@ class SRTTranslatorGUI:
         self.translated_entries = []
         self.batch_files = []  # 存儲批次檔案列表，格式: [{'path': str, 'status': str, 'success': int, 'failed': int}]
         self.current_file_index = 0  # 當前處理的檔案索引
+        self._file_progress = []  # 並行處理中各檔案的完成比例
+        self._progress_sum = 0.0  # _file_progress的總和
+        self._parse_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+        self._pending_files = []  # 解析中的檔案，格式: [(path, future)]，按加入順序排列
+        self._dirty_rows = {}  # 待刷新的檔案列，格式: {file_index: (filename, status, progress)}
+        self._shown_rows = {}  # 已套用到Treeview的各列內容，格式: {item_id: values}
+        self._display_lock = threading.Lock()
+        self.ui_queue = queue.Queue()  # 工作線程提交的界面更新，由主線程執行
+        
+        # 在使用者選擇檔案與設定時預先載入翻譯快取，開始翻譯時不必等待讀取
+        _TRANSLATION_CACHE.load_in_background()
         
         self.setup_ui()
         self.load_config()
+        self.root.after(UI_POLL_MS, self._drain_ui_queue)
         
     def setup_ui(self):
         # 配置框架
@@ -420,11 +1005,27 @@ class SRTTranslatorGUI:
         ttk.Entry(batch_words_frame, textvariable=self.batch_words_var, width=10).pack(side="left")
         ttk.Label(batch_words_frame, text="字 (建議: 50-200)").pack(side="left", padx=(5, 0))
         
+        # 並行請求數設定
+        ttk.Label(config_frame, text="並行請求數:").grid(row=4, column=0, sticky="w", pady=2)
+        self.max_conns_var = tk.StringVar(value=str(MAX_CONCURRENT_BATCHES))
+        max_conns_frame = ttk.Frame(config_frame)
+        max_conns_frame.grid(row=4, column=1, sticky="ew", pady=2)
+        ttk.Entry(max_conns_frame, textvariable=self.max_conns_var, width=10).pack(side="left")
+        ttk.Label(max_conns_frame, text=f"個 (1-{HTTP_POOL_SIZE}，本地模型可調高)").pack(side="left", padx=(5, 0))
+        
+        # 每分鐘請求數設定
+        ttk.Label(config_frame, text="每分鐘請求數:").grid(row=5, column=0, sticky="w", pady=2)
+        self.rpm_var = tk.StringVar(value="0")
+        rpm_frame = ttk.Frame(config_frame)
+        rpm_frame.grid(row=5, column=1, sticky="ew", pady=2)
+        ttk.Entry(rpm_frame, textvariable=self.rpm_var, width=10).pack(side="left")
+        ttk.Label(rpm_frame, text="次 (0為不限制，依API方案的RPM設定)").pack(side="left", padx=(5, 0))
+        
         # 自動分行設定
-        ttk.Label(config_frame, text="自動分行:").grid(row=4, column=0, sticky="w", pady=2)
+        ttk.Label(config_frame, text="自動分行:").grid(row=6, column=0, sticky="w", pady=2)
         self.auto_wrap_var = tk.BooleanVar(value=True)
         auto_wrap_frame = ttk.Frame(config_frame)
-        auto_wrap_frame.grid(row=4, column=1, sticky="ew", pady=2)
+        auto_wrap_frame.grid(row=6, column=1, sticky="ew", pady=2)
         ttk.Checkbutton(auto_wrap_frame, text="超過25字時在第20字處自動分行", variable=self.auto_wrap_var).pack(side="left")
         
         config_frame.columnconfigure(1, weight=1)
@@ -487,7 +1088,7 @@ class SRTTranslatorGUI:
         self.progress_var = tk.StringVar(value="準備就緒")
         ttk.Label(self.root, textvariable=self.progress_var).pack(pady=5)
         
-        self.progress_bar = ttk.Progressbar(self.root, mode='determinate')
+        self.progress_bar = ttk.Progressbar(self.root, mode='determinate', maximum=100)
         self.progress_bar.pack(fill="x", padx=10, pady=5)
         
     def load_config(self):
@@ -500,16 +1101,36 @@ class SRTTranslatorGUI:
                     self.model_var.set(config.get('model', ''))
                     self.api_key_var.set(config.get('api_key', ''))
                     self.batch_words_var.set(config.get('batch_words', '100'))
+                    self.max_conns_var.set(config.get('max_conns', str(MAX_CONCURRENT_BATCHES)))
+                    self.rpm_var.set(config.get('rpm', '0'))
                     self.auto_wrap_var.set(config.get('auto_wrap', True))
+                # 只對使用者保存過的API預熱連線，不向預設網址發送請求
+                warm_up_connections(self.api_url_var.get(), self.get_max_conns())
             except Exception as e:
                 print(f"載入配置失敗: {e}")
     
+    def get_max_conns(self) -> int:
+        """獲取並行請求數設定"""
+        try:
+            return max(1, min(int(self.max_conns_var.get()), HTTP_POOL_SIZE))
+        except ValueError:
+            return MAX_CONCURRENT_BATCHES
+    
+    def get_rpm(self) -> int:
+        """獲取每分鐘請求數上限，0表示不限制"""
+        try:
+            return max(0, int(self.rpm_var.get()))
+        except ValueError:
+            return 0
+    
     def save_config(self):
         config = {
             'api_url': self.api_url_var.get(),
             'model': self.model_var.get(),
             'api_key': self.api_key_var.get(),
             'batch_words': self.batch_words_var.get(),
+            'max_conns': self.max_conns_var.get(),
+            'rpm': self.rpm_var.get(),
             'auto_wrap': self.auto_wrap_var.get()
         }
         
@@ -517,6 +1138,7 @@ class SRTTranslatorGUI:
             with open("srt_translator_config.json", 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)
             messagebox.showinfo("成功", "配置已保存！")
+            warm_up_connections(config['api_url'], self.get_max_conns())
         except Exception as e:
             messagebox.showerror("錯誤", f"保存配置失敗: {e}")
     
@@ -529,41 +1151,66 @@ class SRTTranslatorGUI:
             self.add_file_to_batch(file_path)
     
     def add_file_to_batch(self, file_path):
-        # 檢查檔案是否已存在
+        # 檢查檔案是否已存在或正在解析
         for file_info in self.batch_files:
             if file_info['path'] == file_path:
                 return
+        for pending_path, _ in self._pending_files:
+            if pending_path == file_path:
+                return
         
-        # 嘗試解析SRT文件
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            entries = SRTParser.parse_srt(content)
-        except Exception as e:
-            messagebox.showerror("錯誤", f"無法解析SRT文件 {os.path.basename(file_path)}: {e}")
-            return
-        
-        # 添加新檔案到列表
-        file_info = {
-            'path': file_path,
-            'status': '未處理',
-            'success': 0,
-            'failed': 0,
-            'entries': entries,
-            'failed_indices': []
-        }
-        self.batch_files.append(file_info)
+        # 在背景線程解析SRT文件，完成後經界面隊列回到主線程加入列表（解析線程不直接調用Tk）
+        future = self._parse_executor.submit(self._parse_file, file_path)
+        self._pending_files.append((file_path, future))
+        future.add_done_callback(lambda _: self.post_ui(self._insert_parsed_files, key='parsed_files'))
+    
+    @staticmethod
+    def _parse_file(file_path):
+        entries = SRTParser.parse_srt(SRTParser.read_srt_file(file_path))
         
-        # 在Treeview中添加項目
-        filename = os.path.basename(file_path)
-        entry_count = len(entries) if entries else 0
-        self.files_tree.insert('', 'end', values=(filename, '未處理', f'0/{entry_count}'))
+        # 載入先前已翻譯且原文未變更的條目
+        output_path = f"{os.path.splitext(file_path)[0]}.zh.srt"
+        reused, index_info = TranslationIndex.apply(output_path, entries)
+        return entries, reused, index_info
+    
+    def _insert_parsed_files(self):
+        """按加入順序將已解析完成的檔案加入列表（在主線程調用）"""
+        while self._pending_files and self._pending_files[0][1].done():
+            file_path, future = self._pending_files.pop(0)
+            try:
+                entries, reused, index_info = future.result()
+            except Exception as e:
+                messagebox.showerror("錯誤", f"無法解析SRT文件 {os.path.basename(file_path)}: {e}")
+                continue
+            
+            # 索引來自其他API或模型時，這些譯文翻譯時不會沿用，不計入已完成
+            namespace = APITranslator.namespace_for(self.api_url_var.get(), self.model_var.get())
+            if index_info and index_info['source'] not in (None, namespace):
+                reused = 0
+            
+            # 添加新檔案到列表
+            file_info = {
+                'path': file_path,
+                'status': '未處理',
+                'success': reused,
+                'failed': 0,
+                'entries': entries,
+                'failed_indices': [],
+                'index_info': index_info  # 載入時的索引資訊，第一次翻譯時用於判斷能否沿用輸出檔案
+            }
+            self.batch_files.append(file_info)
+            
+            # 在Treeview中添加項目
+            filename = os.path.basename(file_path)
+            entry_count = len(entries) if entries else 0
+            self.files_tree.insert('', 'end', values=(filename, '未處理', f'{reused}/{entry_count}'))
         
         self.update_status_display()
     
     def clear_files(self):
         self.batch_files.clear()
         self.files_tree.delete(*self.files_tree.get_children())
+        self._shown_rows.clear()
         self.update_status_display()
     
     def remove_selected_file(self):
@@ -657,15 +1304,70 @@ class SRTTranslatorGUI:
                 self.progress_var.set(f"已選擇 {count} 個檔案，準備翻譯")
     
     def update_file_display(self, file_index, filename, status, progress):
-        """更新Treeview中特定檔案的顯示"""
+        """更新Treeview中特定檔案的顯示（由主線程在下一次處理界面隊列時統一刷新）"""
+        with self._display_lock:
+            self._dirty_rows[file_index] = (filename, status, progress)
+    
+    def post_ui(self, callback, *args, key=None):
+        """從工作線程提交界面更新；同一key在一次處理中只執行最後一次"""
+        self.ui_queue.put((key, callback, args))
+    
+    def _drain_ui_queue(self):
+        """在主線程執行所有待處理的界面更新，並刷新檔案列表"""
+        events = {}
+        while True:
+            try:
+                key, callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            if key is None:
+                key = object()
+            else:
+                events.pop(key, None)  # 合併同類更新，保留最後一次的順序
+            events[key] = (callback, args)
+        
+        # 有更新時維持較短間隔，閒置時減少喚醒次數
+        busy = bool(events or self._dirty_rows)
+        self.root.after(UI_POLL_MS if busy else UI_IDLE_POLL_MS, self._drain_ui_queue)
+        
+        self._flush_dirty_rows()
+        for callback, args in events.values():
+            try:
+                callback(*args)
+            except Exception as e:
+                log.warning("更新界面失敗: %s", e)
+    
+    def _flush_dirty_rows(self):
+        """一次套用所有待更新的檔案列"""
+        with self._display_lock:
+            if not self._dirty_rows:
+                return
+            dirty_rows = self._dirty_rows
+            self._dirty_rows = {}
+        
         try:
             # 取得所有children
             children = self.files_tree.get_children()
-            if 0 <= file_index < len(children):
-                item_id = children[file_index]
-                self.files_tree.item(item_id, values=(filename, status, progress))
+            for file_index, values in dirty_rows.items():
+                if 0 <= file_index < len(children):
+                    # 內容與目前顯示相同時不重繪該列
+                    item_id = children[file_index]
+                    if self._shown_rows.get(item_id) != values:
+                        self.files_tree.item(item_id, values=values)
+                        self._shown_rows[item_id] = values
         except Exception as e:
-            print(f"更新檔案顯示失敗: {e}")
+            log.warning("更新檔案顯示失敗: %s", e)
+    
+    def set_progress(self, value):
+        self.progress_bar['value'] = value
+    
+    def finish_file_progress(self, file_index, total_files):
+        """將檔案的進度記為完成（無論成功、失敗或沒有待翻譯條目），並更新整體進度條"""
+        with self._display_lock:
+            self._progress_sum += 1.0 - self._file_progress[file_index]
+            self._file_progress[file_index] = 1.0
+            overall_progress = self._progress_sum * 100 / total_files
+        self.post_ui(self.set_progress, overall_progress, key='progress_bar')
     
     def retry_failed_entries(self, file_index):
         """重試失敗的條目"""
@@ -693,42 +1395,56 @@ class SRTTranslatorGUI:
                 self.translator = APITranslator(
                     self.api_url_var.get(),
                     self.model_var.get(),
-                    self.api_key_var.get()
+                    self.api_key_var.get(),
+                    self.get_max_conns(),
+                    self.get_rpm()
                 )
             
             file_info = self.batch_files[file_index]
             filename = os.path.basename(file_info['path'])
             failed_indices = file_info['failed_indices'].copy()
             
-            self.progress_var.set(f"重試失敗條目: {filename}")
+            self.post_ui(self.progress_var.set, f"重試失敗條目: {filename}", key='progress')
         except Exception as e:
-            self.progress_var.set("重試失敗")
-            messagebox.showerror("錯誤", f"初始化API失敗: {e}")
+            self.post_ui(self.progress_var.set, "重試失敗", key='progress')
+            self.post_ui(messagebox.showerror, "錯誤", f"初始化API失敗: {e}")
             return
         
         retry_success = 0
         retry_failed = 0
         new_failed_indices = []
+        changed = False  # 是否有任何條目的輸出內容改變
         
-        for idx in failed_indices:
-            if idx < len(file_info['entries']):
-                entry = file_info['entries'][idx]
-                try:
-                    # 單獨翻譯失敗的條目
-                    translation = self.translator.translate_text(entry.text)
-                    entry.translated_text = translation.strip()
-                    
-                    if translation and not translation.startswith("[翻譯失敗]"):
-                        retry_success += 1
-                    else:
-                        retry_failed += 1
-                        new_failed_indices.append(idx)
-                        
-                except Exception as e:
-                    print(f"重試條目 {idx} 失敗: {e}")
-                    entry.translated_text = f"[翻譯失敗] {entry.text}"
+        def retry_entry(idx):
+            """單獨翻譯失敗的條目，返回譯文或例外"""
+            try:
+                return self.translator.translate_text(file_info['entries'][idx].text)
+            except Exception as e:
+                return e
+        
+        # 各條目互不相依，並行送出；並行數與批次翻譯相同
+        retry_indices = [idx for idx in failed_indices if idx < len(file_info['entries'])]
+        with ThreadPoolExecutor(max_workers=self.get_max_conns()) as executor:
+            results = list(executor.map(retry_entry, retry_indices))
+        
+        for idx, translation in zip(retry_indices, results):
+            entry = file_info['entries'][idx]
+            previous_text = entry.translated_text
+            if isinstance(translation, Exception):
+                log.warning("重試條目 %d 失敗: %s", idx, translation)
+                entry.translated_text = f"[翻譯失敗] {entry.text}"
+                retry_failed += 1
+                new_failed_indices.append(idx)
+            else:
+                entry.translated_text = translation.strip()
+                
+                if translation and not translation.startswith("[翻譯失敗]"):
+                    retry_success += 1
+                else:
                     retry_failed += 1
                     new_failed_indices.append(idx)
+            
+            changed = changed or entry.translated_text != previous_text
         
         # 更新統計
         file_info['success'] += retry_success
@@ -745,18 +1461,24 @@ class SRTTranslatorGUI:
         total_entries = len(file_info['entries'])
         progress_text = f"{file_info['success']}/{total_entries}"
         self.update_file_display(file_index, filename, status_text, progress_text)
-        self.update_status_display()
+        self.post_ui(self.update_status_display, key='status')
         
-        # 保存結果
-        try:
-            base_name = os.path.splitext(file_info['path'])[0]
-            output_path = f"{base_name}.zh.srt"
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(SRTParser.entries_to_srt(file_info['entries'], auto_wrap=self.auto_wrap_var.get()))
-        except Exception as e:
-            print(f"保存重試結果失敗: {e}")
+        # 所有條目重試完後一次寫回；內容沒有變化時不重寫檔案
+        base_name = os.path.splitext(file_info['path'])[0]
+        output_path = f"{base_name}.zh.srt"
+        if changed or not os.path.exists(output_path):
+            try:
+                with open(output_path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+                    SRTParser.write_entries(f, file_info['entries'], auto_wrap=self.auto_wrap_var.get())
+            except Exception as e:
+                log.warning("保存重試結果失敗: %s", e)
+                TranslationIndex.discard(output_path)
+            else:
+                TranslationIndex.save(output_path, file_info['entries'], self.translator.cache_namespace,
+                                      self.auto_wrap_var.get())
+        self.translator.cache.save_in_background()
         
-        self.progress_var.set(f"重試完成: 成功 {retry_success}, 失敗 {retry_failed}")
+        self.post_ui(self.progress_var.set, f"重試完成: 成功 {retry_success}, 失敗 {retry_failed}", key='progress')
     
     def retranslate_file(self, file_index):
         """重新翻譯整個文件"""
@@ -773,9 +1495,10 @@ class SRTTranslatorGUI:
             file_info['failed'] = 0
             file_info['failed_indices'] = []
             
-            # 清除現有翻譯
+            # 清除現有翻譯；下次翻譯時不使用快取中的舊譯文
             for entry in file_info['entries']:
                 entry.translated_text = ""
+            file_info['retranslate'] = True
             
             # 更新顯示
             total_entries = len(file_info['entries'])
@@ -862,13 +1585,23 @@ class SRTTranslatorGUI:
             self.translator = APITranslator(
                 self.api_url_var.get(),
                 self.model_var.get(),
-                self.api_key_var.get()
+                self.api_key_var.get(),
+                self.get_max_conns(),
+                self.get_rpm()
             )
             
             total_files = len(self.batch_files)
             overall_stats = {'success': 0, 'failed': 0, 'total_entries': 0}
             
-            for file_index, file_info in enumerate(self.batch_files):
+            stats_lock = threading.Lock()
+            self._file_progress = [0.0] * total_files
+            self._progress_sum = 0.0
+            workers = threading.local()  # 每個檔案線程重用自己的BatchTranslator
+            # 所有檔案的批次共用一個請求線程池，總線程數不隨同時翻譯的檔案數增加
+            request_executor = ThreadPoolExecutor(max_workers=self.get_max_conns(),
+                                                  thread_name_prefix="srt-request")
+            
+            def process_file(file_index, file_info):
                 self.current_file_index = file_index
                 file_path = file_info['path']
                 filename = os.path.basename(file_path)
@@ -877,28 +1610,33 @@ class SRTTranslatorGUI:
                 file_info['status'] = '處理中'
                 self.update_file_display(file_index, filename, '處理中', '0/0')
                 
-                self.progress_var.set(f"處理檔案 {file_index + 1}/{total_files}: {filename}")
+                self.post_ui(self.progress_var.set, f"處理檔案 {file_index + 1}/{total_files}: {filename}", key='progress')
                 
                 try:
                     # 使用已解析的條目
                     entries = file_info['entries']
-                    overall_stats['total_entries'] += len(entries)
-                    
+                    with stats_lock:
+                        overall_stats['total_entries'] += len(entries)
+                
                     if not entries:
-                        print(f"警告：檔案 {filename} 無法解析或為空")
+                        log.warning("檔案 %s 無法解析或為空", filename)
                         file_info['status'] = '失敗'
                         self.update_file_display(file_index, filename, '失敗', '0/0')
-                        continue
-                    
+                        return
+                
                     # 翻譯檔案
-                    file_stats = self.translate_single_file(file_info, file_index, total_files)
+                    if not hasattr(workers, 'batch_translator'):
+                        workers.batch_translator = BatchTranslator(self.translator)
+                    file_stats = self.translate_single_file(file_info, file_index, total_files,
+                                                            workers.batch_translator, request_executor)
                     file_info['success'] = file_stats['success']
                     file_info['failed'] = file_stats['failed']
                     file_info['failed_indices'] = file_stats['failed_indices']
-                    
-                    overall_stats['success'] += file_stats['success']
-                    overall_stats['failed'] += file_stats['failed']
-                    
+                
+                    with stats_lock:
+                        overall_stats['success'] += file_stats['success']
+                        overall_stats['failed'] += file_stats['failed']
+                
                     # 更新最終狀態
                     if file_stats['failed'] == 0:
                         file_info['status'] = '完成'
@@ -906,17 +1644,29 @@ class SRTTranslatorGUI:
                     else:
                         file_info['status'] = '部分失敗'
                         status_text = '部分失敗'
-                    
+                
                     progress_text = f"{file_stats['success']}/{file_stats['success'] + file_stats['failed']}"
                     self.update_file_display(file_index, filename, status_text, progress_text)
-                    self.update_status_display()  # 更新主要狀態顯示
-                    
+                    self.post_ui(self.update_status_display, key='status')  # 更新主要狀態顯示
+                
                 except Exception as e:
-                    print(f"處理檔案 {filename} 時發生錯誤: {e}")
+                    log.warning("處理檔案 %s 時發生錯誤: %s", filename, e)
                     file_info['status'] = '失敗'
                     self.update_file_display(file_index, filename, '失敗', '0/0')
-                    self.update_status_display()  # 更新主要狀態顯示
-                    continue
+                    self.post_ui(self.update_status_display, key='status')  # 更新主要狀態顯示
+                
+                finally:
+                    self.finish_file_progress(file_index, total_files)
+            
+            # 多個檔案同時翻譯，API請求數由translator統一限制
+            try:
+                with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FILES) as executor:
+                    futures = [executor.submit(process_file, file_index, file_info)
+                               for file_index, file_info in enumerate(self.batch_files)]
+                    for future in as_completed(futures):
+                        future.result()
+            finally:
+                request_executor.shutdown()
             
             # 顯示整體結果
             result_msg = f"批次翻譯完成！\n"
@@ -926,82 +1676,142 @@ class SRTTranslatorGUI:
             result_msg += f"翻譯失敗: {overall_stats['failed']}\n"
             result_msg += f"成功率: {overall_stats['success'] / max(1, overall_stats['total_entries']) * 100:.1f}%"
             
-            self.progress_var.set(f"批次翻譯完成！成功 {overall_stats['success']}/{overall_stats['total_entries']}")
-            messagebox.showinfo("完成", result_msg)
+            self.post_ui(self.progress_var.set, f"批次翻譯完成！成功 {overall_stats['success']}/{overall_stats['total_entries']}", key='progress')
+            self.post_ui(messagebox.showinfo, "完成", result_msg)
             
         except Exception as e:
-            self.progress_var.set("批次翻譯失敗")
-            messagebox.showerror("錯誤", f"批次翻譯失敗: {e}")
+            self.post_ui(self.progress_var.set, "批次翻譯失敗", key='progress')
+            self.post_ui(messagebox.showerror, "錯誤", f"批次翻譯失敗: {e}")
     
-    def translate_single_file(self, file_info, file_index, total_files):
+    def translate_single_file(self, file_info, file_index, total_files, batch_translator=None,
+                              request_executor=None):
         file_path = file_info['path']
         entries = file_info['entries']
         filename = os.path.basename(file_path)
-        batch_translator = BatchTranslator(self.translator)
+        if batch_translator is None:
+            batch_translator = BatchTranslator(self.translator)
+        else:
+            batch_translator.reset()
         # 獲取批次字數設定
         try:
             max_words = int(self.batch_words_var.get())
             if max_words < 10:
                 max_words = 10
-            elif max_words > 500:
-                max_words = 500
+            elif max_words > AIMD_MAX_WORDS:
+                max_words = AIMD_MAX_WORDS
         except ValueError:
             max_words = 100
         
-        batches = batch_translator.create_batches(entries, max_words=max_words)
-        
-        total_batches = len(batches)
-        file_stats = {'success': 0, 'failed': 0, 'failed_indices': []}
-        
-        entry_idx = 0
-        for batch_idx, batch in enumerate(batches):
-            progress_text = f"檔案 {file_index + 1}/{total_files} ({filename}) - 翻譯批次 {batch_idx + 1}/{total_batches}"
-            self.progress_var.set(progress_text)
+        def on_batch_done(completed_batches, total_batches, completed_entries):
+            progress_text = f"檔案 {file_index + 1}/{total_files} ({filename}) - 翻譯批次 {completed_batches}/{total_batches}"
+            self.post_ui(self.progress_var.set, progress_text, key='progress')
             
             # 更新進度條
-            overall_progress = ((file_index * 100) + (batch_idx + 1) * 100 / total_batches) / total_files
-            self.progress_bar.config(maximum=100)
-            self.progress_bar['value'] = overall_progress
+            # 只累加此檔案比例的變化量，不必每個批次重新加總所有檔案
+            fraction = completed_entries / len(pending_entries)
+            with self._display_lock:
+                self._progress_sum += fraction - self._file_progress[file_index]
+                self._file_progress[file_index] = fraction
+                overall_progress = self._progress_sum * 100 / total_files
+            self.post_ui(self.set_progress, overall_progress, key='progress_bar')
             
             # 更新檔案進度顯示
-            current_progress = f"{file_stats['success'] + file_stats['failed']}/{len(entries)}"
-            self.update_file_display(file_index, filename, '處理中', current_progress)
-            
-            try:
-                context = batch_translator.get_context(entries, entry_idx)
-                translations = batch_translator.translate_batch(batch, context)
-                
-                for entry, translation in zip(batch, translations):
-                    entry.translated_text = translation
-                    if translation and not translation.startswith("[翻譯失敗]"):
-                        file_stats['success'] += 1
-                    else:
-                        file_stats['failed'] += 1
-                        file_stats['failed_indices'].append(entry_idx)
-                    entry_idx += 1
-                    
-            except Exception as e:
-                print(f"檔案 {filename} 批次 {batch_idx + 1} 翻譯失敗: {e}")
-                for entry in batch:
-                    entry.translated_text = f"[翻譯失敗] {entry.text}"
-                    file_stats['failed'] += 1
-                    file_stats['failed_indices'].append(entry_idx)
-                    entry_idx += 1
-            
-            self.root.update_idletasks()
-            time.sleep(1)  # API調用間隔
+            done_entries = len(entries) - len(pending_entries) + completed_entries
+            self.update_file_display(file_index, filename, '處理中', f"{done_entries}/{len(entries)}")
         
-        # 保存翻譯結果
         base_name = os.path.splitext(file_path)[0]
         output_path = f"{base_name}.zh.srt"
+        auto_wrap = self.auto_wrap_var.get()
+        namespace = self.translator.cache_namespace
+        
+        # 索引來自其他API或模型時，與翻譯快取一致，不沿用其譯文（舊版索引沒有source，照常沿用）
+        index_info = file_info.pop('index_info', None)
+        if index_info and index_info['source'] not in (None, namespace):
+            for entry in entries:
+                entry.translated_text = ""
+        
+        # 只翻譯尚未成功翻譯的條目（先前已翻譯的條目由索引檔載入）
+        pending_entries = [entry for entry in entries
+                           if not entry.translated_text or entry.translated_text.startswith("[翻譯失敗]")]
+        
+        # 原文、API、模型與分行設定都與上次相同，現有的輸出檔案即為結果，不必重寫
+        if (not pending_entries and index_info and index_info['complete']
+                and index_info['source'] == namespace and index_info['auto_wrap'] == auto_wrap
+                and os.path.exists(output_path)):
+            log.info("檔案 %s 未變更，沿用現有輸出: %s", filename, output_path)
+            return {'success': len(entries), 'failed': 0, 'failed_indices': []}
+        
+        positions = {id(entry): i for i, entry in enumerate(entries)}
+        
+        # 翻譯結果按順序逐批寫入輸出檔案
+        written = {'count': 0}
         
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(SRTParser.entries_to_srt(entries, auto_wrap=self.auto_wrap_var.get()))
-            print(f"檔案 {filename} 翻譯完成，輸出至: {output_path}")
+            output_file = open(output_path, 'w', encoding='utf-8', buffering=1 << 16)
         except Exception as e:
-            print(f"保存檔案 {filename} 時發生錯誤: {e}")
+            log.warning("保存檔案 %s 時發生錯誤: %s", filename, e)
+            output_file = None
+        
+        def write_until(end):
+            """將entries[已寫入:end]寫入輸出檔案（中間可能夾有先前已翻譯的條目）"""
+            nonlocal output_file
+            if not output_file or end <= written['count']:
+                return
+            try:
+                SRTParser.write_entries(output_file, entries[written['count']:end], auto_wrap,
+                                        leading_separator=written['count'] > 0)
+                output_file.flush()
+                written['count'] = end
+            except Exception as e:
+                log.warning("保存檔案 %s 時發生錯誤: %s", filename, e)
+                output_file.close()
+                output_file = None
+        
+        last_checkpoint = {'time': time.monotonic()}
+        
+        def on_entries_ready(ready_entries):
+            write_until(positions[id(ready_entries[-1])] + 1)
+            
+            # 定期保存索引檔與快取，中斷後重新加入檔案時可沿用已完成的譯文
+            # 索引只記錄已寫入輸出檔案的條目，輸出檔案寫入失敗後不再保存
+            now = time.monotonic()
+            if output_file and now - last_checkpoint['time'] >= CHECKPOINT_INTERVAL:
+                last_checkpoint['time'] = now
+                TranslationIndex.save(output_path, entries[:written['count']], namespace, auto_wrap)
+                self.translator.cache.save_in_background()
+        
+        try:
+            batch_translator.translate_all(pending_entries, max_words=max_words,
+                                           max_concurrent=self.get_max_conns(),
+                                           progress_callback=on_batch_done,
+                                           ordered_callback=on_entries_ready,
+                                           executor=request_executor,
+                                           use_cache=not file_info.pop('retranslate', False))
+            write_until(len(entries))
+        except BaseException:
+            TranslationIndex.discard(output_path)
+            raise
+        finally:
+            if output_file:
+                output_file.close()
+        
+        # 一次掃描找出失敗條目，成功數由總數推得
+        failed_indices = [entry_idx for entry_idx, entry in enumerate(entries)
+                          if not entry.translated_text or entry.translated_text.startswith("[翻譯失敗]")]
+        file_stats = {
+            'success': len(entries) - len(failed_indices),
+            'failed': len(failed_indices),
+            'failed_indices': failed_indices
+        }
+        
+        # 只有輸出檔案完整寫入時才保存索引，否則刪除舊索引，以免下次誤判為未變更而沿用不完整的輸出
+        if written['count'] == len(entries):
+            log.info("檔案 %s 翻譯完成，輸出至: %s", filename, output_path)
+            TranslationIndex.save(output_path, entries, namespace, auto_wrap)
+        else:
+            TranslationIndex.discard(output_path)
         
+        self.translator.cache.save_in_background()
         return file_stats
     
     